@@ -2,11 +2,27 @@ import asyncio
 import random
 import time
 import argparse
-import math
+import logging
+from dataclasses import dataclass
+from typing import Optional
 
 from viam.robot.client import RobotClient
 from viam.components.motor import Motor
 
+from retry import async_retry, is_timeout, is_transient
+
+WHEEL_POSITIONS = 6
+WHEEL_RPM = 10
+
+
+@dataclass
+class State:
+    api_key: str
+    api_key_id: str
+    smart_machine_domain: str
+    robot: Optional[RobotClient] = None
+    wheel_motor: Optional[Motor] = None
+
 
 async def connect(api_key, api_key_id, smart_machine_domain):
     opts = RobotClient.Options.with_api_key(
@@ -19,6 +35,25 @@ async def connect(api_key, api_key_id, smart_machine_domain):
     opts.disable_sessions=True
     return await RobotClient.at_address(smart_machine_domain, opts)
 
+async def reconnect(state: State):
+    # Close the old client first, the ESP32 struggles to accept new connections after unclean disconnects
+    if state.robot is not None:
+        try:
+            await state.robot.close()
+        except Exception as e:
+            if not is_transient(e):
+                raise
+            print("failed to close old connection", e)
+        finally:
+            state.robot = None
+            state.wheel_motor = None
+    state.robot = await connect(state.api_key, state.api_key_id, state.smart_machine_domain)
+    state.wheel_motor = Motor.from_robot(state.robot, "wheel_motor")
+
+# Only the first connection retries on its own. Later reconnects happen inside rotate_with_retry,
+# whose retries already cover them, so a move never dials more than 5 times.
+connect_on_startup = async_retry(attempts=10)(reconnect)
+
 async def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--api-key", required=True, type=str)
@@ -27,20 +62,18 @@ async def main():
     args = parser.parse_args()
 
     print("connecting...")
-    n_try = 10
-    while n_try:
-        try:
-            smart_machine = await connect(args.api_key, args.api_key_id, args.smart_machine_domain)
-            break;
-        except Exception as e:
-            n_try = n_try - 1;
-    if n_try == 0:
-        print("cannot connect, exiting")
+    state = State(args.api_key, args.api_key_id, args.smart_machine_domain)
+    try:
+        await connect_on_startup(state)
+    except Exception as e:
+        # only a failed connection means "cannot connect", anything else (e.g. no wheel_motor) is raised as is
+        if not is_transient(e):
+            raise
+        print("cannot connect, exiting", e)
         exit()
 
     print("turning wheel to initial position 0")
-    for _ in range(6):
-        await rotate_with_retry(smart_machine, -1/12)
+    await rotate_with_retry(state, -0.5)
 
     current_wheel_position = 0
     while True:
@@ -48,25 +81,29 @@ async def main():
         if current_wheel_position != next_wheel_position:
             print("turning wheel from", current_wheel_position, " to position ", next_wheel_position)    
             slices = (current_wheel_position - next_wheel_position)
-            direction = math.copysign(1,slices)
-            for _ in range(abs(slices)*2):
-                await rotate_with_retry(smart_machine, -1/12*direction)
+            await rotate_with_retry(state, -slices/WHEEL_POSITIONS)
             current_wheel_position = next_wheel_position
 
-async def rotate_with_retry(smart_machine: RobotClient, rotations: float):
+@async_retry(attempts=5)
+async def rotate_with_retry(state: State, revolutions: float):
+    if state.wheel_motor is None:
+        print("CUSTOM ATTEMPT to reconnect")
+        await reconnect(state)
     try:
-        wheel_motor = Motor.from_robot(smart_machine, "wheel_motor")
-        await wheel_motor.set_power(rotations)
+        # One command for the whole move, the sign of revolutions gives the direction
+        await state.wheel_motor.go_for(WHEEL_RPM, revolutions)
     except Exception as e:
-        print("CUSTOM ATTEMPT to reconnect after exception", e)
-        while True:
-            try:
-                smart_machine = await connect(args.api_key, args.api_key_id, args.smart_machine_domain)
-                break
-            except Exception as e:
-                print("CUSTOM ATTEMPT to reconnect after exception", e)
-                continue
+        if is_timeout(e):
+            # Same as reader.py: the robot keeps turning after a deadline timeout, so the move is done.
+            # Sending the relative move again would turn the wheel twice as far.
+            print("assuming move finished after timeout", e)
+            return
+        if is_transient(e):
+            # the cached motor belongs to a connection that may be gone, reconnect on the next attempt
+            state.wheel_motor = None
+        raise
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
     asyncio.run(main())
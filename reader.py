@@ -1,18 +1,26 @@
 from __future__ import print_function
 
 import datetime
+import json
+import logging
 import argparse
 import os.path
 import time
-import math
-
+import ssl
+import threading
+import uuid
+from types import MappingProxyType
+from dataclasses import dataclass
+from typing import Optional, TYPE_CHECKING
 
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials as GoogleCredentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from google_auth_httplib2 import AuthorizedHttp
+import httplib2
 from googleapiclient.errors import HttpError
-from google.auth.exceptions import RefreshError
+from google.auth.exceptions import RefreshError, TransportError
 
 import asyncio
 
@@ -20,6 +28,12 @@ from viam.robot.client import RobotClient
 from viam.rpc.dial import Credentials as ViamCredentials, DialOptions
 from viam.components.motor import Motor
 
+# aiohttp is only needed for --webhook-address, Watcher imports it when it starts
+if TYPE_CHECKING:
+    from aiohttp import web
+
+from retry import async_retry, is_timeout, is_transient, RETRYABLE_HTTP_STATUSES
+
 # If modifying these scopes, delete the file token.json.
 SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
 
@@ -30,12 +44,93 @@ FOCUS_TIME = 3
 AVAILABLE = 4
 IN_MEETING = 5
 
-event_type_to_wheel_position = {
-    "outOfOffice": 0,
-    "focusTime": 3,
-    "default": 5
-}
+# How long before an event starts the wheel switches to GOING_TO_EVENT
+GOING_TO_EVENT_WINDOW = datetime.timedelta(minutes=5)
+
+WHEEL_POSITIONS = 6
+WHEEL_RPM = 10
+
+# Built once and passed to every events.list. googleapiclient only repeats the query parameter for an
+# actual list (a tuple would be sent as its string form), so this stays a list and is never mutated.
+EVENT_TYPES = ["default", "focusTime", "outOfOffice", "workingLocation"]
+# Partial response, only what merge_events and get_next_wheel_position read. The full event
+# resource is many times larger (attendees, description, conference data, ...).
+EVENT_LIST_FIELDS = ('nextPageToken,nextSyncToken,'
+                     'items(id,status,eventType,summary,start(dateTime,date),end(dateTime,date))')
+SYNC_TOKEN_FILE = '.sync_token'
+# Upper bound for Calendar API calls, far below the per-project quota
+CALENDAR_REQUESTS_PER_MINUTE = 60
+CALENDAR_HTTP_TIMEOUT = 10
+# Failures to reach Google, as opposed to local file or credential errors. TransportError is what the
+# hourly access token refresh raises when Google can't be reached.
+CALENDAR_NETWORK_ERRORS = (ConnectionError, TimeoutError, ssl.SSLError, httplib2.HttpLib2Error, TransportError)
+# When polling, sync with the calendar at most this often (seconds)
+CALENDAR_CACHE_TTL = 120
+
+# Renew the calendar watch channel this many seconds before it expires
+WATCH_RENEW_MARGIN = 600
+# With a watcher, still sync at least this often (seconds) in case a notification or its sync got lost
+WATCH_BACKSTOP_TTL = 900
+
+log = logging.getLogger(__name__)
+
+# Read-only so the table can be shared and is never rebuilt per call
+event_type_to_wheel_position = MappingProxyType({
+    "outOfOffice": OUT_OF_OFFICE,
+    "focusTime": FOCUS_TIME,
+    "default": IN_MEETING,
+})
+
+class ConnectError(ConnectionError):
+    """Raised when every attempt to connect to the robot failed. main() lets it end the program."""
+    def __init__(self, last_exception: Exception, elapsed: float):
+        super().__init__("Could not connect to robot after %.1fs, last error: %s. Make sure that robot is on and "
+                         "connected to wifi, or try hitting RESET on ESP32." % (elapsed, last_exception))
+        self.last_exception = last_exception
+        self.elapsed = elapsed
+
+@dataclass
+class State:
+    robot: Optional[RobotClient] = None
+    wheel_motor: Optional[Motor] = None
+
+async def reconnect(state: State, location_secret: str, robot_address: str):
+    started = time.monotonic()
+    try:
+        state.robot = await connect(location_secret, robot_address)
+    except Exception as e:
+        if not is_transient(e):
+            raise
+        raise ConnectError(e, time.monotonic() - started) from e
+    state.wheel_motor = Motor.from_robot(state.robot, "wheel_motor")
+
+async def ensure_connected(state: State):
+    """Checks the current connection with a cheap RPC. Only if that fails is the connection dropped,
+    so the next tick reconnects from scratch. This avoids a full reconnect for transient timeouts.
+    """
+    if state.robot is not None:
+        try:
+            await state.robot.refresh()
+            if state.wheel_motor is None:
+                state.wheel_motor = Motor.from_robot(state.robot, "wheel_motor")
+            print("connection still healthy, keeping it")
+            return
+        except Exception as e:
+            if not is_transient(e):
+                raise
+            print("connection health check failed", e)
+    await disconnect(state)
+
+async def disconnect(state: State):
+    if state.robot is not None:
+        await state.robot.close()
+    state.robot = None
+    state.wheel_motor = None
 
+# 12 attempts spread over about two minutes, sleeping 0.2, 0.4, ... and at most 30s in between
+CONNECT_ATTEMPTS = 12
+
+@async_retry(attempts=CONNECT_ATTEMPTS, base=0.2, cap=30.0)
 async def connect(location_secret: str, robot_address: str):
     creds = ViamCredentials(
         type='robot-location-secret',
@@ -46,146 +141,458 @@ async def connect(location_secret: str, robot_address: str):
         # not available in SDK yet (pending release)
         # timeout=5
     )
-    for x in range(50):
-        try:
-            print("connection try", x)
-            return await RobotClient.at_address(robot_address, opts)
-        except Exception as e:
-            print("Failed to connect. Please try hitting RESET on ESP32", e)
-            pass
-    raise Exception("Too many connection attempts to robot failed. Please sure that robot is on and connected to wifi.")
+    return await RobotClient.at_address(robot_address, opts)
+
+# The next event on the calendar, kept up to date by refresh_next_event. Reading it is free,
+# so the main loop can check it every tick without talking to Google.
+cached_next_event = None
+
+# Events that have not ended yet keyed by event id, and the token to fetch changes to them with.
+# Both are persisted to SYNC_TOKEN_FILE so a restart does not need a full sync.
+upcoming_events = {}
+sync_token = None
+# time.monotonic() of the last successful sync, 0 forces the next refresh to sync
+last_sync = 0.0
+
+# refresh_next_event runs in worker threads (the polling tick and webhook notifications) while the
+# loop calls update_next_event, so changes to the state above go through this lock
+calendar_lock = threading.RLock()
 
-def get_next_wheel_position() -> int:
-    """Shows basic usage of the Google Calendar API.
-    Prints the start and name of the next 10 events on the user's calendar.
+class TokenBucket:
+    """Allows rate calls per period on average, in bursts of at most rate calls.
+    acquire() blocks the calling thread until enough tokens are available. Calendar calls already
+    run in worker threads, so this never holds up the event loop.
     """
-    creds = None
+    def __init__(self, rate: int, period: float = 60.0):
+        self.capacity = rate
+        self.tokens = float(rate)
+        self.fill_rate = rate / period
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: int = 1):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.fill_rate)
+                self.last = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait_time = (tokens - self.tokens) / self.fill_rate
+            print("calendar rate limit reached, waiting", round(wait_time, 1), "s")
+            time.sleep(wait_time)
+
+# Bounds Calendar API calls no matter how often syncs and retries ask for them
+calendar_rate_limit = TokenBucket(CALENDAR_REQUESTS_PER_MINUTE)
+
+# Loaded once and reused across ticks, see get_calendar_service
+google_creds = None
+calendar_service = None
+
+def invalidate_calendar_cache():
+    global last_sync
+    last_sync = 0.0
+
+def get_calendar_service():
+    """Returns the Calendar API service, loading credentials and building it only on first use.
+    token.json is only rewritten when the credentials actually had to be refreshed or re-authorized.
+    """
+    global google_creds, calendar_service
     # The file token.json stores the user's access and refresh tokens, and is
     # created automatically when the authorization flow completes for the first
     # time.
-    if os.path.exists('token.json'):
-        creds = GoogleCredentials.from_authorized_user_file('token.json', SCOPES)
+    if google_creds is None and os.path.exists('token.json'):
+        google_creds = GoogleCredentials.from_authorized_user_file('token.json', SCOPES)
+    creds_before = google_creds
     # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
+    if not google_creds or not google_creds.valid:
+        if google_creds and google_creds.expired and google_creds.refresh_token:
                 try:
-                    creds.refresh(Request())
+                    google_creds.refresh(Request())
                 except RefreshError:
-                    creds = get_creds()
+                    google_creds = get_creds()
         else:
-            creds = get_creds()
+            google_creds = get_creds()
         # Save the credentials for the next run
         with open('token.json', 'w') as token:
-            token.write(creds.to_json())
+            token.write(google_creds.to_json())
+    # The AuthorizedHttp holds the credentials object, so an in-place refresh needs no rebuild and the
+    # keep-alive connection survives. Only a new object from get_creds() does.
+    if google_creds is not creds_before:
+        calendar_service = None
+    if calendar_service is None:
+        # One Http for the lifetime of the service keeps the TLS connection to Google alive across ticks.
+        # httplib2 is not thread safe, callers hold calendar_lock while using the service.
+        http = AuthorizedHttp(google_creds, http=httplib2.Http(timeout=CALENDAR_HTTP_TIMEOUT))
+        calendar_service = build('calendar', 'v3', http=http, cache_discovery=False, static_discovery=True)
+    return calendar_service
+
+def refresh_next_event(max_age: float = 0):
+    """Brings upcoming_events up to date with the user's calendar and updates cached_next_event.
+    The first call does a full sync, after that only the changes since the last sync token are fetched.
+    If the last sync is less than max_age seconds old, the calendar is not contacted at all.
+    """
+    with calendar_lock:
+        _refresh_next_event(max_age)
 
+def _refresh_next_event(max_age: float):
+    global sync_token, last_sync
+    if time.monotonic() - last_sync < max_age:
+        update_next_event()
+        return
     try:
-        service = build('calendar', 'v3', credentials=creds)
+        service = get_calendar_service()
+        if sync_token is None:
+            sync_token = load_sync_token()
+        if sync_token is None:
+            full_sync(service)
+        else:
+            try:
+                incremental_sync(service)
+            except HttpError as error:
+                if error.resp.status != 410:
+                    raise
+                # 410 GONE means the sync token was invalidated, start over with a full sync
+                print("sync token expired, doing full sync")
+                full_sync(service)
+        save_sync_token()
+        last_sync = time.monotonic()
+    except HttpError as error:
+        if error.resp.status not in RETRYABLE_HTTP_STATUSES:
+            raise
+        # Keep the events we have, the next tick tries again
+        print('Calendar temporarily unavailable: %s' % error)
+    except CALENDAR_NETWORK_ERRORS as error:
+        # Not being able to reach Google says nothing about the robot connection, so don't let it propagate.
+        # Local problems (credentials.json missing, token.json or .sync_token not writable) still do.
+        print('Could not reach calendar: %s' % error)
+    update_next_event()
+
+def list_events(service, **kwargs):
+    """Pages through events().list and returns all items plus the final nextSyncToken."""
+    items = []
+    page_token = None
+    while True:
+        calendar_rate_limit.acquire()
+        events_result = service.events().list(calendarId='primary', singleEvents=True,
+                                              eventTypes=EVENT_TYPES, pageToken=page_token,
+                                              fields=EVENT_LIST_FIELDS, **kwargs).execute()
+        items.extend(events_result.get('items', []))
+        page_token = events_result.get('nextPageToken')
+        if page_token is None:
+            return items, events_result.get('nextSyncToken')
 
-        # Call the Calendar API
-        now = datetime.datetime.utcnow().isoformat() + 'Z'  # 'Z' indicates UTC time
-        print('Getting the upcoming 10 events')
-        events_result = service.events().list(calendarId='primary', timeMin=now,
-                                              maxResults=1, singleEvents=True,
-                                              orderBy='startTime', eventTypes=["default", "focusTime", "outOfOffice", "workingLocation"]).execute()
-        events = events_result.get('items', [])
+def full_sync(service):
+    global sync_token
+    print('Syncing all events')
+    items, sync_token = list_events(service)
+    upcoming_events.clear()
+    merge_events(items)
 
-        if not events:
+def incremental_sync(service):
+    global sync_token
+    print('Syncing changed events')
+    items, sync_token = list_events(service, syncToken=sync_token)
+    merge_events(items)
+
+def merge_events(items):
+    for event in items:
+        if event.get('status') == 'cancelled':
+            upcoming_events.pop(event['id'], None)
+        else:
+            upcoming_events[event['id']] = event
+    # Events that already ended will never be the next event again
+    for event_id in [event_id for event_id, event in upcoming_events.items() if event_has_ended(event)]:
+        del upcoming_events[event_id]
+
+def update_next_event():
+    """Picks the next event out of upcoming_events. Does no I/O."""
+    global cached_next_event
+    # This is called from the event loop, so never wait for a sync running in a thread.
+    # That sync ends by calling update_next_event itself.
+    if not calendar_lock.acquire(blocking=False):
+        return
+    try:
+        merge_events([])
+        if not upcoming_events:
             print('No upcoming events found.')
+            cached_next_event = None
             return
+        cached_next_event = min(upcoming_events.values(), key=lambda event: event_date(event['start']))
+    finally:
+        calendar_lock.release()
 
-        event = events[0]
-        event_type = event['eventType']
-        print("next event type:", event_type)
-        start = event['start'].get('dateTime', event['start'].get('date'))
-        start_date = datetime.datetime.fromisoformat(start)
-        if event_type == 'workingLocation':
-            if event['summary'] != "Office":
-                return WORK_FROM_HOME
-        elif start_date >= datetime.datetime.now(start_date.tzinfo) + datetime.timedelta(minutes=5):
-            print("next event is > 5min from now, so AVAILABLE")
-            return AVAILABLE
-        elif start_date > datetime.datetime.now(start_date.tzinfo):
-            print("next event is <= 5min from now, so GOING_TO_EVENT")
-            return GOING_TO_EVENT
-        wheel_position = event_type_to_wheel_position.get(event_type)
-        return wheel_position
+def load_sync_token():
+    """Restores the sync token and the events it covers from SYNC_TOKEN_FILE, if present."""
+    if not os.path.exists(SYNC_TOKEN_FILE):
+        return None
+    with open(SYNC_TOKEN_FILE) as f:
+        saved = json.load(f)
+    upcoming_events.clear()
+    upcoming_events.update(saved['events'])
+    return saved['syncToken']
 
-    except HttpError as error:
-        print('An error occurred: %s' % error)
+def save_sync_token():
+    with open(SYNC_TOKEN_FILE, 'w') as f:
+        json.dump({'syncToken': sync_token, 'events': upcoming_events}, f)
+
+def event_date(when) -> datetime.datetime:
+    """Parses an event start or end. All day events only have a date, which is taken as local midnight."""
+    return datetime.datetime.fromisoformat(when.get('dateTime', when.get('date'))).astimezone()
+
+def event_has_ended(event) -> bool:
+    return event_date(event['end']) <= datetime.datetime.now().astimezone()
+
+def get_next_wheel_position(event, now: Optional[datetime.datetime] = None) -> int:
+    """Maps the next calendar event to a wheel position. Does no I/O, and given the same event
+    and now always returns the same position.
+    """
+    if event is None:
+        print("no upcoming events, so AVAILABLE")
+        return AVAILABLE
+    if now is None:
+        now = datetime.datetime.now().astimezone()
+
+    event_type = event['eventType']
+    print("next event type:", event_type)
+    if event_type == 'workingLocation':
+        return OUT_OF_OFFICE if event['summary'] == "Office" else WORK_FROM_HOME
+    start_date = event_date(event['start'])
+    if start_date >= now + GOING_TO_EVENT_WINDOW:
+        print("next event is > 5min from now, so AVAILABLE")
+        return AVAILABLE
+    if start_date > now:
+        print("next event is <= 5min from now, so GOING_TO_EVENT")
+        return GOING_TO_EVENT
+    return event_type_to_wheel_position.get(event_type, IN_MEETING)
+
+class Watcher:
+    """Registers a Google Calendar push notification channel and refreshes cached_next_event
+    whenever Google reports that the calendar changed. Channels expire, so run() keeps
+    renewing the channel shortly before it does.
+    """
+    def __init__(self, address: str, port: int):
+        self.address = address
+        self.port = port
+        self.channel_id = None
+        self.resource_id = None
+        self.expiration = 0.0
+        self.runner = None
+        # Syncs started by notifications, kept so they aren't garbage collected while running
+        self.refresh_tasks = set()
+
+    def watch(self):
+        with calendar_lock:
+            self._watch()
+
+    def _watch(self):
+        service = get_calendar_service()
+        channel_id = str(uuid.uuid4())
+        calendar_rate_limit.acquire()
+        channel = service.events().watch(calendarId='primary', body={
+            'id': channel_id,
+            'type': 'web_hook',
+            'address': self.address,
+        }).execute()
+        old_channel = (self.channel_id, self.resource_id)
+        self.channel_id = channel_id
+        self.resource_id = channel['resourceId']
+        # expiration is reported in milliseconds since the epoch
+        self.expiration = int(channel['expiration']) / 1000
+        print("watching calendar on channel", self.channel_id, "until", datetime.datetime.fromtimestamp(self.expiration))
+        if old_channel[0] is not None:
+            try:
+                calendar_rate_limit.acquire()
+                service.channels().stop(body={'id': old_channel[0], 'resourceId': old_channel[1]}).execute()
+            except HttpError as error:
+                print('Failed to stop old channel: %s' % error)
+
+    async def handle_notification(self, request: 'web.Request') -> 'web.Response':
+        from aiohttp import web
+        channel_id = request.headers.get('X-Goog-Channel-ID')
+        resource_state = request.headers.get('X-Goog-Resource-State')
+        if channel_id == self.channel_id and resource_state == 'exists':
+            print("calendar changed, refreshing next event")
+            # Answer right away instead of holding the request open through the sync and rate limit waits.
+            # A failed sync is caught up by the backstop sync in the main loop.
+            task = asyncio.create_task(asyncio.to_thread(refresh_next_event))
+            self.refresh_tasks.add(task)
+            task.add_done_callback(self.refresh_done)
+        return web.Response()
+
+    def refresh_done(self, task: asyncio.Task):
+        self.refresh_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print("Failed to refresh after calendar notification", task.exception())
+
+    async def start(self):
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_post('/', self.handle_notification)
+        self.runner = web.AppRunner(app)
+        try:
+            await self.runner.setup()
+            await web.TCPSite(self.runner, port=self.port).start()
+            await asyncio.to_thread(self.watch)
+        except BaseException:
+            # don't leave the port bound and accepting notifications for a channel that doesn't exist
+            await self.stop()
+            raise
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def run(self):
+        """Renews the channel until renewing fails for good, then shuts the webhook server down."""
+        try:
+            while True:
+                await asyncio.sleep(max(0, self.expiration - time.time() - WATCH_RENEW_MARGIN))
+                try:
+                    await asyncio.to_thread(self.watch)
+                except (HttpError,) + CALENDAR_NETWORK_ERRORS as error:
+                    print('Failed to renew calendar watch: %s' % error)
+                    if time.time() >= self.expiration:
+                        raise RuntimeError("calendar watch channel expired") from error
+                    await asyncio.sleep(60)
+        finally:
+            await self.stop()
 
 def get_creds():
     flow = InstalledAppFlow.from_client_secrets_file(
         'credentials.json', SCOPES)
     return flow.run_local_server(port=0)
 
-async def control_wheel(wheel_motor: Motor, current_wheel_position: int) -> (int, Exception):
-    next_wheel_position = get_next_wheel_position()
+async def control_wheel(wheel_motor: Motor, current_wheel_position: int, next_wheel_position: int) -> (int, Exception):
     if current_wheel_position != next_wheel_position:
         print("turning wheel from", current_wheel_position, " to position ", next_wheel_position)    
         slices = (current_wheel_position - next_wheel_position)
-        direction = math.copysign(1,slices)
         try:
             # Trying to catch connection exceptions here doesn't work. When attempting to reconnect, I get the error
             # failed turning wheel [Errno 2] No such file or directory
             # I confirmed that the /tmp socket file is missing that its trying to look for. Seems like a SDK bug.
             # This only and always happens when the "TimeoutError: Deadline exceeded. Connection lost" occurs below
-            for i in range(abs(slices)):
-                await wheel_motor.set_power(1/6*direction)
-                current_wheel_position -= int(direction)
+            # One command for the whole move, the sign of revolutions gives the direction
+            await wheel_motor.go_for(WHEEL_RPM, slices/WHEEL_POSITIONS)
         except Exception as e:
-            # Return the current position as the robot probably turned the last position before exception occurred.
+            if not is_transient(e):
+                raise
             print("exception happened", e)
+            if is_timeout(e):
+                # The robot keeps turning to the requested position after a deadline timeout, so assume it got there.
+                return next_wheel_position, e
+            # Any other error most likely means the command never reached the robot, the next tick retries the move.
             return current_wheel_position, e
-    return current_wheel_position, None
+    return next_wheel_position, None
 
 async def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--location-secret", required=True, type=str)
     parser.add_argument("--robot-address", required=True, type=str)
+    # Public https URL that forwards to --webhook-port. Without it the calendar is polled every tick.
+    parser.add_argument("--webhook-address", type=str)
+    parser.add_argument("--webhook-port", default=8080, type=int)
     args = parser.parse_args()
     print(args)
 
+    watcher = None
+    watch_task = None
+    if args.webhook_address:
+        try:
+            watcher = Watcher(args.webhook_address, args.webhook_port)
+            await watcher.start()
+        except Exception as e:
+            print("Failed to watch calendar, falling back to polling", e)
+            watcher = None
+    if watcher is not None:
+        def on_watch_done(task: asyncio.Task):
+            nonlocal watcher
+            if task.cancelled():
+                return
+            print("Calendar watch stopped, falling back to polling", task.exception())
+            watcher = None
+        watch_task = asyncio.create_task(watcher.run())
+        watch_task.add_done_callback(on_watch_done)
+    await asyncio.to_thread(refresh_next_event)
+
     # try:
     print("connecting to robot")
-    robot = await connect(args.location_secret, args.robot_address)
+    state = State()
+    await reconnect(state, args.location_secret, args.robot_address)
     print("turning wheel to initial position 0")
     while True:
         try:
-            if robot is None:
-                robot = await connect(args.location_secret, args.robot_address)
-            wheel_motor = Motor.from_robot(robot, "wheel_motor")
-            for i in range(6):
-                await wheel_motor.set_power(1/6)
+            if state.wheel_motor is None:
+                await reconnect(state, args.location_secret, args.robot_address)
+            await state.wheel_motor.go_for(WHEEL_RPM, 1)
             break
+        except ConnectError as e:
+            # every attempt already failed with backoff, starting another round would never end
+            log.error("%s (%d connection attempts)", e, CONNECT_ATTEMPTS)
+            raise
         except Exception as e:
-            print("Failed to connect", e)
-            await robot.close()
-            robot = None
-            continue
+            if is_timeout(e):
+                print("Timed out talking to robot", e)
+                await ensure_connected(state)
+            elif is_transient(e):
+                print("Failed to connect", e)
+                await disconnect(state)
+            else:
+                print("Unexpected error, giving up", e)
+                raise
 
     current_wheel_position = 0
     while True:
         try:
-            if robot is None:
-                robot = await connect(args.location_secret, args.robot_address)
-            wheel_motor = Motor.from_robot(robot, "wheel_motor")
+            if state.wheel_motor is None:
+                await reconnect(state, args.location_secret, args.robot_address)
+            if watcher is not None:
+                # changes arrive through the watcher, only drop events that ended since the last tick
+                update_next_event()
+            next_wheel_position = get_next_wheel_position(cached_next_event)
+            if next_wheel_position != current_wheel_position:
+                # re-verify against the calendar right after the wheel moved
+                invalidate_calendar_cache()
+            # Sync the calendar for the next tick while the motor turns. googleapiclient blocks,
+            # so it runs in a thread and the robot connection keeps being serviced meanwhile.
+            # With a watcher, changes arrive as notifications and this is only a backstop for missed ones.
+            max_age = CALENDAR_CACHE_TTL if watcher is None else WATCH_BACKSTOP_TTL
+            prefetch = asyncio.create_task(asyncio.to_thread(refresh_next_event, max_age=max_age))
             # This sometimes fails with the exception "TimeoutError: Deadline exceeded. Connection lost".
             # Seems like the connection is lost while controlling the robot. Even with short gRPC calls
             # Concerning: The robot continues to operate to the desired position but returns an exception early
             # To account for this I assume the robot did turn correctly and still set the wheel position.
-            current_wheel_position, ex = await control_wheel(wheel_motor, current_wheel_position)
+            current_wheel_position, ex = await control_wheel(state.wheel_motor, current_wheel_position, next_wheel_position)
             print("wheel now at: ",current_wheel_position)
+            await prefetch
             if ex is not None:
                 print("exception happened during turning, trying to recover. Exception: ", ex)
+                if is_timeout(ex):
+                    await ensure_connected(state)
+                else:
+                    await disconnect(state)
             else:
-                time.sleep(15)
+                # sleep without blocking the event loop so calendar notifications are handled meanwhile
+                await asyncio.sleep(15)
+        except ConnectError as e:
+            # every attempt already failed with backoff, starting another round would never end
+            log.error("%s (%d connection attempts)", e, CONNECT_ATTEMPTS)
+            raise
         except Exception as e:
-            print("Failed to connect", e)
-            await robot.close()
-            robot = None
-            continue
+            if is_timeout(e):
+                print("Timed out talking to robot", e)
+                await ensure_connected(state)
+            elif is_transient(e):
+                print("Failed to connect", e)
+                await disconnect(state)
+            else:
+                print("Unexpected error, giving up", e)
+                raise
     # If I kill the script (ctrl-c) or an exception happens, I have difficultly connecting again. I have to reset the ESP32 every time.
-    # If I don't reset the board, the script will attempt to connect 50 times with none successful.
+    # If I don't reset the board, all connection attempts fail.
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
     asyncio.run(main())
\ No newline at end of file
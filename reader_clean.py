@@ -4,7 +4,6 @@ import datetime
 import argparse
 import os.path
 import time
-import math
 # import sys
 import random
 
@@ -119,9 +118,9 @@ async def control_wheel(wheel_motor: Motor, current_wheel_position: int) -> (int
     if current_wheel_position != next_wheel_position:
         print("turning wheel from", current_wheel_position, " to position ", next_wheel_position)    
         slices = (current_wheel_position - next_wheel_position)
-        dir = math.copysign(1,slices)
-        for _ in range(abs(slices)*2):
-            await wheel_motor.set_power(-1/12*dir)
+        step = -1/12 if slices > 0 else 1/12
+        for _ in range(2*abs(slices)):
+            await wheel_motor.set_power(step)
             time.sleep(.1)
         return next_wheel_position, None
     return current_wheel_position, None
@@ -0,0 +1,74 @@
+import asyncio
+import functools
+import logging
+import random
+import tempfile
+
+from grpclib.const import Status
+from grpclib.exceptions import GRPCError, StreamTerminatedError
+
+# gRPC statuses that say the call could not get through right now, not that the call itself is wrong
+RETRYABLE_GRPC_STATUSES = (Status.UNAVAILABLE, Status.DEADLINE_EXCEEDED, Status.ABORTED,
+                           Status.RESOURCE_EXHAUSTED)
+
+
+def is_timeout(e: BaseException) -> bool:
+    """True for the "Deadline exceeded" family of errors, after which the robot usually still finishes the command."""
+    if isinstance(e, GRPCError):
+        return e.status == Status.DEADLINE_EXCEEDED
+    return isinstance(e, (TimeoutError, asyncio.TimeoutError))
+
+
+def is_transient(e: BaseException) -> bool:
+    """True for errors that a retry or a reconnect can fix.
+
+    Anything else is a bug or a configuration problem (missing resource, bad credentials, local file
+    errors, ...) and retrying it only hides it.
+    """
+    if is_timeout(e) or isinstance(e, (ConnectionError, StreamTerminatedError)):
+        return True
+    if isinstance(e, GRPCError):
+        return e.status in RETRYABLE_GRPC_STATUSES
+    # The SDK raises "[Errno 2] No such file or directory" when its unix socket in /tmp is gone after
+    # the connection dropped. Unlike a missing credentials file, that error carries no filename.
+    if isinstance(e, FileNotFoundError):
+        return e.filename is None or e.filename.startswith(tempfile.gettempdir())
+    if isinstance(e, PermissionError):
+        return False
+    # Everything else from the OS here is the network going away: EHOSTUNREACH, ENETUNREACH,
+    # socket.gaierror when DNS fails, ... which is exactly what a Wi-Fi drop looks like.
+    return isinstance(e, OSError)
+
+# HTTP statuses from Google APIs that are worth retrying later
+RETRYABLE_HTTP_STATUSES = (429, 500, 502, 503, 504)
+
+log = logging.getLogger(__name__)
+
+
+def expo_backoff(base=0.1, cap=10.0, n=10, jitter=0.1):
+    """Yields n delays of min(cap, base * 2**i) plus up to jitter seconds, so 0.1, 0.2, 0.4, ... with the defaults."""
+    for i in range(n):
+        yield min(cap, base * 2**i) + random.uniform(0, jitter)
+
+
+def async_retry(retry_if=is_transient, attempts=10, base=0.1, cap=10.0, jitter=0.1):
+    """Retries the decorated coroutine function when it raises an exception for which retry_if is true.
+
+    Makes at most attempts calls, sleeping by expo_backoff(base, cap, jitter=jitter) in between.
+    After the last attempt the exception is re-raised.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            delays = expo_backoff(base, cap, attempts - 1, jitter)
+            for attempt in range(attempts):
+                try:
+                    return await func(*args, **kwargs)
+                except Exception as e:
+                    delay = next(delays, None)
+                    if delay is None or not retry_if(e):
+                        raise
+                    log.warning("%s attempt %d failed: %s; sleeping %.1fs", func.__name__, attempt, e, delay)
+                    await asyncio.sleep(delay)
+        return wrapper
+    return decorator